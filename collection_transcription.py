@@ -10,6 +10,9 @@ In addition, the presence of a transcription per page may be tested. More
 precisely, it is checked whether a version exists for each selected page that
 has a number greater than zero in the parameter nrOfCharsInLines.
 
+The documents of a collection are processed in batches of MAX_PARALLEL_JOBS
+documents, whose jobs run at the same time on Transkribus.
+
 Each step is based on an existing model. The following functions are available:
 - Collections not to be considered can be excluded (COLL_DROP).
 - Only a set of documents can be considered (DOC_FILTER_DIR).
@@ -26,34 +29,39 @@ detected.
 
 
 import logging
-import pandas as pd
 import csv
 import time
+from string import Template
 
 from connect_transkribus import (get_sid, list_collections,
                                  list_documents, get_document_content,
-                                 run_layout_analysis, run_text_recognition)
+                                 prefetch_document_contents, wait_for_jobs,
+                                 run_layout_analysis, run_text_recognition,
+                                 invalidate_caches)
 
 
 # Set directory of logfile.
 LOGFILE_DIR = './collection_transcription.log'
 
-# List of collection ids that are dropped within this process.
-COLL_DROP = [169494, 163061, 170320]
+# Set the number of documents whose jobs run at the same time on Transkribus.
+MAX_PARALLEL_JOBS = 8
+
+# Set of collection ids that are dropped within this process.
+COLL_DROP = frozenset([169494, 163061, 170320])
 
 # CSV file, which contains per line a docId of documents to be filtered.
 DOC_FILTER_DIR = './document_filter.csv'
 
-# List of page status (of latest page version) that are dropped within this
+# Set of page status (of latest page version) that are dropped within this
 # process.
-PAGE_DROP_STATUS = ['DONE']
+PAGE_DROP_STATUS = frozenset(['DONE'])
 
 # Define if subsequent pages of a page with a status defined in
 # PAGE_DROP_STATUS within the same Transkribus document should be dropped.
 PAGE_DROP_STATUS_FOLLOWING = True
 
-# List of page numbers that are dropped within this process.
-PAGE_DROP_NR = [1, 2]
+# Set of page numbers that are dropped within this process.
+PAGE_DROP_NR = frozenset([1, 2])
 
 # Set the parameters for P2PaLA.
 P2PALA_ID = 57774
@@ -83,6 +91,134 @@ LINE_OVERLAP_FRACTION = 0.1
 HTR_ID = 52861  # HGB_FT_M5.2
 DO_WORD_SEG = 'false'
 
+# Xml templates for the post requests of the layout analysis jobs. Only the
+# document id and the list of page ids are substituted per document.
+P2PALA_XML = Template(
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<jobParameters><docList><docs><docId>${doc_id}</docId>'
+    '<pageList>${page_list}</pageList></docs></docList><params>'
+    f'<entry><key>modelId</key><value>{P2PALA_ID}</value></entry>'
+    f'<entry><key>modelName</key><value>{P2PALA_NAME}</value></entry>'
+    f'<entry><key>--min_area</key><value>{MIN_AREA}</value></entry>'
+    '<entry><key>--rectify_regions</key>'
+    f'<value>{RECTIFY_REGIONS}</value></entry>'
+    '<entry><key>enrichExistingTranscriptions</key>'
+    f'<value>{ENRICH_EXISTING_TRANSCRIPTIONS}</value></entry>'
+    f'<entry><key>labelRegions</key><value>{LABEL_REGIONS}</value></entry>'
+    f'<entry><key>labelLines</key><value>{LABEL_LINES}</value></entry>'
+    f'<entry><key>labelWords</key><value>{LABEL_WORDS}</value></entry>'
+    '<entry><key>keepExistingRegions</key>'
+    f'<value>{KEEP_EXISTING_REGIONS}</value></entry>'
+    '</params></jobParameters>')
+LINEFINDER_XML = Template(
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<jobParameters><docList><docs><docId>${doc_id}</docId>'
+    '<pageList>${page_list}</pageList></docs></docList><params>'
+    f'<entry><key>modelId</key><value>{LINEFINDER_ID}</value></entry>'
+    f'<entry><key>modelName</key><value>{LINEFINDER_NAME}</value></entry>'
+    '<entry><key>pars.min_path_length</key>'
+    f'<value>{MIN_PATH_LENGTH}</value></entry>'
+    f'<entry><key>pars.bin_thresh</key><value>{BIN_THRESH}</value></entry>'
+    f'<entry><key>pars.sep_thresh</key><value>{SEP_THRESH}</value></entry>'
+    '<entry><key>pars.max_dist_fraction</key>'
+    f'<value>{MAX_DIST_FRACTION}</value></entry>'
+    '<entry><key>pars.clustering_method</key>'
+    f'<value>{CLUSTERING_METHOD}</value></entry>'
+    '<entry><key>pars.clustering_legacy_type</key>'
+    f'<value>{CLUSTERING_LEGACY_TYPE}</value></entry>'
+    '<entry><key>pars.cluster_dist_fraction</key>'
+    f'<value>{CLUSTER_DIST_FRACTION}</value></entry>'
+    f'<entry><key>pars.scale</key><value>{SCALE}</value></entry>'
+    '<entry><key>pars.line_overlap_fraction</key>'
+    f'<value>{LINE_OVERLAP_FRACTION}</value></entry>'
+    '</params></jobParameters>')
+
+
+def process_batch(batch, colid, colname, sid, do_p2pala, do_linefinder,
+                  do_htr, do_test):
+    # Apply the selected models to a batch of documents. The jobs of the
+    # documents within the batch run at the same time, each step after the
+    # previous one.
+    start_time = time.time()
+
+    if do_p2pala:
+        # Start a P2PaLA job per document.
+        jobids = []
+        for doc, page_nr_selected, pageid_str in batch:
+            jobids.append(run_layout_analysis(
+                xml=P2PALA_XML.substitute(doc_id=doc['docId'],
+                                          page_list=pageid_str),
+                colid=colid,
+                sid=sid,
+                do_block_seg='true',
+                job_impl='P2PaLAJob',
+                wait=False
+                ))
+        wait_for_jobs(jobids, sid)
+
+    if do_linefinder:
+        # Start a line finder job per document.
+        jobids = []
+        for doc, page_nr_selected, pageid_str in batch:
+            jobids.append(run_layout_analysis(
+                xml=LINEFINDER_XML.substitute(doc_id=doc['docId'],
+                                              page_list=pageid_str),
+                colid=colid,
+                sid=sid,
+                wait=False
+                ))
+        wait_for_jobs(jobids, sid)
+
+    if do_htr:
+        # Start a text recognition job per document.
+        jobids = []
+        for doc, page_nr_selected, pageid_str in batch:
+            # Create a string of selected pages for HTR request.
+            pages_str = ','.join(map(str, page_nr_selected))
+            jobids.append(run_text_recognition(
+                colid=colid,
+                docid=doc['docId'],
+                pages=pages_str,
+                model_id=HTR_ID,
+                sid=sid,
+                do_word_seg=DO_WORD_SEG,
+                wait=False
+                ))
+        wait_for_jobs(jobids, sid)
+
+    if do_p2pala or do_linefinder or do_htr:
+        # The jobs changed the documents on Transkribus. Drop the cached
+        # collection and document lists.
+        invalidate_caches()
+
+    if do_test:
+        # Search for pages with no version with nrOfCharsInLines > 0.
+        for doc, page_nr_selected, pageid_str in batch:
+            doc_content = get_document_content(
+                colid=colid, docid=doc['docId'], sid=sid
+                )
+            doc_pages = doc_content['pageList']['pages']
+            for page_nr in page_nr_selected:
+                n_char = 0
+                ts = doc_pages[page_nr - 1]['tsList']['transcripts']
+                for transcript in ts:
+                    n_char = transcript['nrOfCharsInLines']
+                    if n_char > 0:
+                        break
+                if n_char == 0:
+                    logging.warning(
+                        'The following page has no transcription: '
+                        f'collection {colname} ({colid}), '
+                        f"document {doc['title']} ({doc['docId']}), "
+                        f"page {page_nr} ({ts[0]['pageId']}).")
+
+    titles = ', '.join(doc['title'] for doc, _, _ in batch)
+    n_pages = sum(len(page_nr_selected)
+                  for _, page_nr_selected, _ in batch)
+    logging.info(f'Time to process documents {titles}: '
+                 f'{round(time.time() - start_time, 2)}s. '
+                 f'Number of pages processed: {n_pages}.')
+
 
 def main():
     # Define the logging environment.
@@ -102,7 +238,7 @@ def main():
         do_p2pala = False
     else:
         logging.error(f'Your answer is not True or False: {do_p2pala}.')
-        raise
+        raise ValueError(f'Your answer is not True or False: {do_p2pala}.')
     logging.info(f'P2PaLA will be applied: {do_p2pala}.')
     do_linefinder = input('Do you want to apply Linefinder (text line '
                           'recognition)? ')
@@ -112,7 +248,7 @@ def main():
         do_linefinder = False
     else:
         logging.error(f'Your answer is not True or False: {do_linefinder}.')
-        raise
+        raise ValueError(f'Your answer is not True or False: {do_linefinder}.')
     logging.info(f'Linefinder will be applied: {do_linefinder}.')
     do_htr = input('Do you want to apply HTR (text recognition)? ')
     if do_htr.lower() in ('true', 'yes', 'y', '1'):
@@ -121,7 +257,7 @@ def main():
         do_htr = False
     else:
         logging.error(f'Your answer is not True or False: {do_htr}.')
-        raise
+        raise ValueError(f'Your answer is not True or False: {do_htr}.')
     logging.info(f'HTR will be applied: {do_htr}.')
 
     # Define if the presence of a transcription is to be tested.
@@ -132,7 +268,7 @@ def main():
         do_test = False
     else:
         logging.error(f'Your answer is not True or False: {do_test}.')
-        raise
+        raise ValueError(f'Your answer is not True or False: {do_test}.')
     logging.info(f'Test is being performed: {do_test}.')
 
     # Login to Transkribus.
@@ -141,168 +277,51 @@ def main():
     sid = get_sid(user, password)
 
     # Define all collections to be processed.
-    coll_raw = pd.DataFrame(list_collections(sid))
-    coll = coll_raw[~coll_raw['colId'].isin(COLL_DROP)]
+    coll = [c for c in list_collections(sid) if c['colId'] not in COLL_DROP]
 
     # Load document ids to be processed.
     with open(DOC_FILTER_DIR, 'r') as csvfile:
-        doc_filter = [int(row[0]) for row in csv.reader(csvfile)]
+        doc_filter = {int(row[0]) for row in csv.reader(csvfile)}
 
-    for row in coll.iterrows():
-        logging.info(f"Processing collection {row[1]['colName']}...")
+    for c in coll:
+        colid = c['colId']
+        colname = c['colName']
+        logging.info(f'Processing collection {colname}...')
 
         # Define all documents to be processed.
-        docs_raw = list_documents(sid, row[1]['colId'])
+        docs_raw = list_documents(sid, colid)
         docs = [d for d in docs_raw if d['docId'] in doc_filter]
 
-        for doc in docs:
-            start_time = time.time()
-
-            # Generate a dictionary of pages to process.
-            pages = get_document_content(row[1]['colId'],
-                                         doc['docId'],
-                                         sid)['pageList']
+        # Generate a dictionary of pages to process per document and process
+        # the documents in batches. Documents without pages to consider are
+        # omitted. The contents of the next documents are downloaded while
+        # the jobs of the current batch run.
+        batch = []
+        for doc, doc_content in prefetch_document_contents(colid, docs, sid):
             page_nr_selected = {}
-            drop_following_pages = False
-            for page in pages['pages']:
-                if drop_following_pages:
-                    break
-                elif page['pageNr'] in PAGE_DROP_NR:
+            for page in doc_content['pageList']['pages']:
+                page_nr = page['pageNr']
+                if page_nr in PAGE_DROP_NR:
                     continue
-                elif (page['tsList']['transcripts'][0]['status'] in
-                      PAGE_DROP_STATUS):
+                status = page['tsList']['transcripts'][0]['status']
+                if status in PAGE_DROP_STATUS:
                     if PAGE_DROP_STATUS_FOLLOWING:
-                        drop_following_pages = True
+                        # Drop all subsequent pages of the document.
+                        break
                     continue
-                else:
-                    page_nr_selected[page['pageNr']] = page['pageId']
-
-            # Omit layout analysis and text recognition if there are no pages
-            # to consider.
-            if not page_nr_selected:
-                continue
-
-            # Generate xml string of page ids.
-            pageid_str = ''
-            for p in list(page_nr_selected.values()):
-                pageid_str += f'<pages><pageId>{p}</pageId></pages>'
-
-            if do_p2pala:
-                # Generate xml for post request for P2PaLA job.
-                p2pala_xml = '<?xml version="1.0" encoding="UTF-8" '\
-                    'standalone="yes"?>'\
-                    f"<jobParameters><docList><docs><docId>{doc['docId']}"\
-                    f'</docId><pageList>{pageid_str}</pageList></docs>'\
-                    '</docList><params>'\
-                    f'<entry><key>modelId</key><value>{P2PALA_ID}</value>'\
-                    '</entry>'\
-                    f'<entry><key>modelName</key><value>{P2PALA_NAME}</value>'\
-                    '</entry>'\
-                    f'<entry><key>--min_area</key><value>{MIN_AREA}</value>'\
-                    '</entry>'\
-                    '<entry><key>--rectify_regions</key><value>'\
-                    f'{RECTIFY_REGIONS}</value></entry>'\
-                    '<entry><key>enrichExistingTranscriptions</key>'\
-                    f'<value>{ENRICH_EXISTING_TRANSCRIPTIONS}</value></entry>'\
-                    f'<entry><key>labelRegions</key><value>{LABEL_REGIONS}'\
-                    '</value></entry>'\
-                    f'<entry><key>labelLines</key><value>{LABEL_LINES}'\
-                    '</value></entry>'\
-                    f'<entry><key>labelWords</key><value>{LABEL_WORDS}'\
-                    '</value></entry>'\
-                    '<entry><key>keepExistingRegions</key><value>'\
-                    f'{KEEP_EXISTING_REGIONS}</value></entry></params>'\
-                    '</jobParameters>'
-
-                # Start a P2PaLA job.
-                run_layout_analysis(
-                    xml=p2pala_xml,
-                    colid=row[1]['colId'],
-                    sid=sid,
-                    do_block_seg='true',
-                    job_impl='P2PaLAJob'
-                    )
-
-            if do_linefinder:
-                # Generate xml for post request for line finder job.
-                linefinder_xml = '<?xml version="1.0" encoding="UTF-8" '\
-                    'standalone="yes"?>'\
-                    f"<jobParameters><docList><docs><docId>{doc['docId']}"\
-                    f'</docId><pageList>{pageid_str}</pageList></docs>'\
-                    '</docList><params>'\
-                    f'<entry><key>modelId</key><value>{LINEFINDER_ID}</value>'\
-                    '</entry>'\
-                    f'<entry><key>modelName</key><value>{LINEFINDER_NAME}'\
-                    '</value></entry>'\
-                    '<entry><key>pars.min_path_length</key><value>'\
-                    f'{MIN_PATH_LENGTH}</value></entry>'\
-                    f'<entry><key>pars.bin_thresh</key><value>{BIN_THRESH}'\
-                    '</value></entry><entry><key>pars.sep_thresh</key><value>'\
-                    f'{SEP_THRESH}</value></entry>'\
-                    '<entry><key>pars.max_dist_fraction</key><value>'\
-                    f'{MAX_DIST_FRACTION}</value></entry>'\
-                    '<entry><key>pars.clustering_method</key><value>'\
-                    f'{CLUSTERING_METHOD}</value></entry>'\
-                    '<entry><key>pars.clustering_legacy_type</key><value>'\
-                    f'{CLUSTERING_LEGACY_TYPE}</value></entry>'\
-                    '<entry><key>pars.cluster_dist_fraction</key><value>'\
-                    f'{CLUSTER_DIST_FRACTION}</value></entry>'\
-                    f'<entry><key>pars.scale</key><value>{SCALE}</value>'\
-                    '</entry>'\
-                    '<entry><key>pars.line_overlap_fraction</key><value>'\
-                    f'{LINE_OVERLAP_FRACTION}</value></entry>'\
-                    '</params></jobParameters>'
-
-                # Start a line finder job.
-                run_layout_analysis(
-                    xml=linefinder_xml,
-                    colid=row[1]['colId'],
-                    sid=sid
-                    )
-
-            if do_htr:
-                # Create a string of selected pages for HTR request.
-                pages_str = ','.join(
-                    [str(key) for key in page_nr_selected.keys()]
-                    )
-
-                # Start a text recognition job.
-                run_text_recognition(
-                    colid=row[1]['colId'],
-                    docid=doc['docId'],
-                    pages=pages_str,
-                    model_id=HTR_ID,
-                    sid=sid,
-                    do_word_seg=DO_WORD_SEG
-                    )
-
-            if do_test:
-                # Search for pages with no version with nrOfCharsInLines > 0.
-                doc_content = get_document_content(
-                    colid=row[1]['colId'], docid=doc['docId'], sid=sid
-                    )
-                doc_pages = doc_content['pageList']['pages']
-                for page_nr in page_nr_selected:
-                    n_char = 0
-                    ts = doc_pages[page_nr - 1]['tsList']['transcripts']
-                    for transcript in ts:
-                        n_char = transcript['nrOfCharsInLines']
-                        if n_char > 0:
-                            break
-                    if n_char == 0:
-                        logging.warning('The following page has no '
-                                        'transcription: '
-                                        f"collection {row[1]['colName']} "
-                                        f"({row[1]['colId']}), "
-                                        f"document {doc['title']} "
-                                        f"({doc['docId']}), "
-                                        f"page {page_nr} ({ts[0]['pageId']})."
-                                        )
-
-            logging.info(f"Time to process document {doc['title']}: "
-                         f'{round(time.time() - start_time, 2)}s. '
-                         f'Number of pages processed: {len(page_nr_selected)}.'
-                         )
+                page_nr_selected[page_nr] = page['pageId']
+            if page_nr_selected:
+                # Generate xml string of page ids.
+                pageid_str = ''.join(f'<pages><pageId>{p}</pageId></pages>'
+                                     for p in page_nr_selected.values())
+                batch.append((doc, page_nr_selected, pageid_str))
+            if len(batch) == MAX_PARALLEL_JOBS:
+                process_batch(batch, colid, colname, sid, do_p2pala,
+                              do_linefinder, do_htr, do_test)
+                batch = []
+        if batch:
+            process_batch(batch, colid, colname, sid, do_p2pala,
+                          do_linefinder, do_htr, do_test)
 
     logging.info('Script finished.')
 
@@ -4,74 +4,258 @@ Script to interact with the API of the Transkribus platform.
 
 
 import requests
-import xml.etree.ElementTree as et
+from requests.adapters import HTTPAdapter
 import time
 import logging
-import pandas as pd
 import re
+import orjson
+from collections import deque
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+import random
+from http.cookiejar import DefaultCookiePolicy
+
+
+# Base url of the Transkribus REST API.
+BASE_URL = 'https://transkribus.eu/TrpServer/rest/'
+
+# Share one session over all requests to reuse the connections to the
+# Transkribus server. The adapter does not retry requests itself, transient
+# errors are retried by the retry decorator only.
+_SESSION = requests.Session()
+_SESSION.mount('https://', HTTPAdapter(pool_connections=32, pool_maxsize=64))
+
+# Do not store cookies set by the server, e.g. the JSESSIONID of the login
+# response. The session id given to the functions is sent as the only
+# JSESSIONID cookie.
+_SESSION.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+# Headers of the layout analysis requests.
+_LA_HEADERS = {'Content-Type': 'application/xml', 'Accept': 'application/json'}
+
+# Session id within the login response.
+_SESSION_ID_RE = re.compile(rb'<sessionId>([^<]+)</sessionId>')
+
+
+class TranskribusHTTPError(requests.HTTPError):
+    """Request to the Transkribus platform not successful.
+
+    Attributes:
+        status (int): Status code of the response.
+        retry_after (int): Waiting time in seconds requested by the server
+            with a Retry-After header, otherwise 0.
+    """
+
+    def __init__(self, message, response):
+        self.status = response.status_code
+        retry_after = response.headers.get('Retry-After', '')
+        self.retry_after = int(retry_after) if retry_after.isdigit() else 0
+        super().__init__(f'{message} {response.status_code} {response.reason}',
+                         response=response)
+
+
+def retry(n_retry=5, delay=1, max_delay=60):
+    """Retry a function on transient request errors with exponential backoff.
+    Connection errors, interrupted response bodies, timeouts and responses
+    with a server error status are considered transient. All other errors are
+    raised immediately. The waiting times are randomised to spread the
+    retries of concurrent requests and respect a Retry-After header of the
+    server.
+
+    Args:
+        n_retry (int): Number of maximal retries.
+        delay (float): Waiting time in seconds before the first retry. The
+            waiting time is doubled with every further retry.
+        max_delay (float): Maximal waiting time in seconds between retries
+            (before randomisation).
+
+    Returns:
+        function: Decorator for the function to be retried.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            for attempt in range(n_retry + 1):
+                try:
+                    return func(*args, **kwargs)
+                except requests.RequestException as err:
+                    if attempt == n_retry or not _is_transient(err):
+                        raise
+                    wait = (min(max_delay, delay * 2 ** attempt)
+                            * random.uniform(0.5, 1.5))
+                    wait = max(wait, getattr(err, 'retry_after', 0))
+                    logging.warning(f'{func.__name__} failed: {err}. '
+                                    f'Retry in {round(wait, 1)}s.')
+                    time.sleep(wait)
+        return wrapper
+    return decorator
+
+
+def _is_transient(err):
+    # Test if a request error may disappear by retrying the request
+
+    if isinstance(err, (requests.ConnectionError, requests.Timeout,
+                        requests.exceptions.ChunkedEncodingError)):
+        return True
+    if isinstance(err, TranskribusHTTPError):
+        return err.status >= 500 or err.status == 429
+    if isinstance(err, requests.HTTPError):
+        return (err.response is None or err.response.status_code >= 500
+                or err.response.status_code == 429)
+    return False
+
+
+def _find_value(data, key):
+    # Return the first value of a key found in decoded json data
+
+    if isinstance(data, dict):
+        if key in data:
+            return data[key]
+        data = list(data.values())
+    if isinstance(data, list):
+        for item in data:
+            value = _find_value(item, key)
+            if value is not None:
+                return value
+    return None
+
+
+def _to_bytes(xml):
+    # Encode a xml string as utf-8, bytes are passed through
+
+    return xml.encode('utf8') if isinstance(xml, str) else xml
+
+
+def _raise_for_status(r, message):
+    # Log and raise a TranskribusHTTPError if the request was not successful
+
+    if r.status_code != requests.codes.ok:
+        logging.error(f'{message} {r}')
+        raise TranskribusHTTPError(message, r)
+
+
+def close_session():
+    # Close the connections of the module session. Subsequent requests open
+    # new connections.
+
+    _SESSION.close()
+
+
+def invalidate_caches():
+    # Drop all cached responses, e.g. in long-running jobs where collections
+    # or documents may have changed on Transkribus.
+
+    _list_collections_raw.cache_clear()
+    _collections_index.cache_clear()
+    _list_documents_raw.cache_clear()
 
 
 def get_sid(usr, pw):
     # Login to the API of transkribus and return the session id
 
-    r = requests.post("https://transkribus.eu/TrpServer/rest/auth/login", data={"user": usr, "pw": pw})
-    if r.status_code == requests.codes.ok:
-        login_data = et.fromstring(r.text)
-        return login_data.find("sessionId").text
-    else:
-        logging.error(f'Login failed: {r}')
-        raise
+    r = _SESSION.post(BASE_URL + 'auth/login', data={"user": usr, "pw": pw})
+    _raise_for_status(r, 'Login failed:')
+
+    # The login response contains a single sessionId element.
+    return _SESSION_ID_RE.search(r.content).group(1).decode()
 
 
 def list_collections(sid):
     # Get information of all collections available for the account
+    # The response is cached per session id.
+
+    return orjson.loads(_list_collections_raw(sid))
 
-    r = requests.get("https://transkribus.eu/TrpServer/rest/collections/list?JSESSIONID={}".format(sid))
-    if r.status_code == requests.codes.ok:
-        return r.json()
-    else:
-        logging.error(f'SessionID invalid? {r}')
-        raise
+
+@functools.lru_cache(maxsize=4)
+@retry()
+def _list_collections_raw(sid):
+    # Request the raw list of collections available for the account
+
+    r = _SESSION.get(BASE_URL + 'collections/list',
+                     cookies={"JSESSIONID": sid})
+    _raise_for_status(r, 'SessionID invalid?')
+    return r.content
 
 
 def get_colid(col_name, sid):
     '''Given the name of one collection and session id,
     the function returns the corresponding collection id, if available.'''
 
-    # Get available collections
-    coll = pd.DataFrame(list_collections(sid))
-
     try:
         # Determine collection id of interest
-        return coll[coll['colName'] == col_name]['colId'].iloc[0]
-    except:
+        return _collections_index(sid)[col_name]
+    except KeyError:
         # Collection with name given not found
         logging.error(f'No collection of name {col_name} found.')
         raise
 
 
+@functools.lru_cache(maxsize=4)
+def _collections_index(sid):
+    # Map the names of available collections to their ids, keeping the first
+    # collection per name
+
+    index = {}
+    for c in list_collections(sid):
+        index.setdefault(c['colName'], c['colId'])
+    return index
+
+
 def list_documents(sid, colid):
     # Get information of all documents of one collection
+    # The response is cached per session id and collection.
+
+    return orjson.loads(_list_documents_raw(sid, colid))
 
-    r = requests.get("https://transkribus.eu/TrpServer/rest/collections/{}/list?JSESSIONID={}".format(colid, sid))
-    if r.status_code == requests.codes.ok:
-        return r.json()
-    else:
-        logging.error(f'SessionID or collectionID invalid? {r}')
-        raise
 
+@functools.lru_cache(maxsize=128)
+@retry()
+def _list_documents_raw(sid, colid):
+    # Request the raw list of documents of one collection
 
+    r = _SESSION.get(BASE_URL + f'collections/{colid}/list',
+                     cookies={"JSESSIONID": sid})
+    _raise_for_status(r, 'SessionID or collectionID invalid?')
+    return r.content
+
+
+@retry()
 def get_document_content(colid, docid, sid):
     # Get content of a specific document
 
-    r = requests.get("https://transkribus.eu/TrpServer/rest/collections/{}/{}/fulldoc?JSESSIONID={}".format(colid,
-                                                                                                            docid,
-                                                                                                            sid))
-    if r.status_code == requests.codes.ok:
-        return r.json()
-    else:
-        logging.error(f'documentID or collectionID invalid? {r}')
-        raise
+    r = _SESSION.get(BASE_URL + f'collections/{colid}/{docid}/fulldoc',
+                     cookies={"JSESSIONID": sid})
+    _raise_for_status(r, 'documentID or collectionID invalid?')
+    return orjson.loads(r.content)
+
+
+def prefetch_document_contents(colid, docs, sid, depth=8):
+    """Iterate over documents together with their content.
+    The content of the following documents is requested in the background,
+    so that it is downloaded while the current document is processed.
+
+    Args:
+        colid (int): Id of collection.
+        docs (list): Documents as returned by list_documents.
+        sid (str): Session id to Transkribus platform.
+        depth (int): Number of documents requested ahead.
+
+    Yields:
+        tuple: Document and its content.
+    """
+    with ThreadPoolExecutor(max_workers=depth) as executor:
+        futures = deque()
+        for doc in docs:
+            futures.append((doc, executor.submit(get_document_content, colid,
+                                                 doc['docId'], sid)))
+            if len(futures) == depth:
+                next_doc, future = futures.popleft()
+                yield next_doc, future.result()
+        while futures:
+            next_doc, future = futures.popleft()
+            yield next_doc, future.result()
 
 
 def get_page_xml_url(doc_content, page_nr, page_version):
@@ -81,71 +265,89 @@ def get_page_xml_url(doc_content, page_nr, page_version):
     return doc_content['pageList']['pages'][page_nr - 1]['tsList']['transcripts'][page_version]['url']
 
 
-def get_page_xml(urlxml, sid, n_retry=60):
+def index_page_urls(doc_content):
+    # Given the document content derived by get_document_content(),
+    # returns the page xml urls of all page versions keyed by page number and
+    # page version
+
+    return {(page_nr, page_version): transcript['url']
+            for page_nr, page in enumerate(doc_content['pageList']['pages'], 1)
+            for page_version, transcript in enumerate(page['tsList']['transcripts'])}
+
+
+def get_page_xml(urlxml, sid, n_retry=60, *, raw=False):
     # Get the page xml of a given document page
+    # Transient request errors are retried up to n_retry times.
+    # If raw is True, the utf-8 encoded bytes are returned instead of a str,
+    # e.g. to be passed to an xml parser directly.
 
-    try:
-        r = requests.get(urlxml)
-        r.encoding = 'utf-8'
-        if r.status_code == requests.codes.ok:
-            return r.text
-        elif r.status_code == 500:
-            # Internal Server Error: try again.
-            if n_retry > 0:
-                n_retry -= 1
-                time.sleep(60)
-                return get_page_xml(urlxml, sid, n_retry)
-            else:
-                logging.error(f'url invalid? {r}')
-                raise
-        else:
-            if n_retry > 0:
-                n_retry -= 1
-                time.sleep(60)
-                return get_page_xml(urlxml, sid, n_retry)
-            else:
-                logging.error(f'url invalid? {r}')
-                raise
-    except requests.ConnectionError as err:
-        # Retry if the connection went lost.
-        if n_retry > 0:
-            n_retry -= 1
-            time.sleep(60)
-            return get_page_xml(urlxml, sid, n_retry)
-        else:
-            logging.error(f'Connection error: {err}')
-            raise
+    return retry(n_retry=n_retry)(_get_page_xml)(urlxml, raw)
+
+
+def _get_page_xml(urlxml, raw):
+    # Request a page xml once
+
+    r = _SESSION.get(urlxml)
+    _raise_for_status(r, 'url invalid?')
+    return r.content if raw else r.content.decode('utf-8', errors='replace')
 
 
 def post_page_xml(page_xml, colid, docid, page_nr, sid, comment, status=''):
     # Update a page xml of a given document page (API method postPageTranscript)
     # If variable status is an empty string, the status on Transkribus will not change.
+    # The page xml may be given as str or as utf-8 encoded bytes.
 
-    r = requests.post(f'https://transkribus.eu/TrpServer/rest/collections/{colid}/{docid}/{page_nr}/text?JSESSIONID={sid}',
-                      data=page_xml.encode('utf8'), params={'note': comment, 'status': status}
+    r = _SESSION.post(BASE_URL + f'collections/{colid}/{docid}/{page_nr}/text',
+                      data=_to_bytes(page_xml), params={'note': comment, 'status': status},
+                      cookies={'JSESSIONID': sid}
                       )
-    if r.status_code == requests.codes.ok:
-        return True
-    else:
-        logging.error(f'documentID or collectionID invalid? {r}')
-        raise
+    _raise_for_status(r, 'documentID or collectionID invalid?')
+    return True
+
+
+def post_page_xmls(pages, colid, docid, sid, comment, status='', max_workers=8):
+    """Update several page xmls of a document concurrently.
+    The uploads share the connection pool of the module session.
 
+    Args:
+        pages (list): Tuples of page number and page xml to be uploaded.
+        colid (int): Id of collection.
+        docid (int): Id of document.
+        sid (str): Session id to Transkribus platform.
+        comment (str): Comment of the new page versions.
+        status (str): Status of the new page versions. If empty, the status
+            on Transkribus will not change.
+        max_workers (int): Number of concurrent uploads.
+
+    Returns:
+        list: True per page uploaded, in the order of pages.
 
+    Raises:
+        TranskribusHTTPError: Request status code is not OK.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(
+            lambda page: post_page_xml(page[1], colid, docid, page[0], sid,
+                                       comment, status),
+            pages))
+
+
+@retry()
 def update_page_status(colid, docid, pagenr, transcriptid, status, sid, comment='Status changed.'):
-    '''Updates a transcript status of a specific page using the Transkribus API method updatePageStatus.'''
+    '''Updates a transcript status of a specific page using the Transkribus API method updatePageStatus.
+    Setting a status is idempotent, so transient request errors are retried.'''
 
-    r = requests.post(f'https://transkribus.eu/TrpServer/rest/collections/{colid}/{docid}/{pagenr}/{transcriptid}/status?JSESSIONID={sid}',
-                    params={'note': comment, 'status': status}
-                    )
-    if r.status_code == requests.codes.ok:
-        return True
-    else:
-        logging.error(f'collectionID, documentID, pageNr or transcriptId invalid? {r}')
-        raise
+    r = _SESSION.post(BASE_URL + f'collections/{colid}/{docid}/{pagenr}/{transcriptid}/status',
+                      params={'note': comment, 'status': status},
+                      cookies={'JSESSIONID': sid}
+                      )
+    _raise_for_status(r, 'collectionID, documentID, pageNr or transcriptId invalid?')
+    return True
 
 
 def get_job_status(jobid: int, sid: str, n_retry: int = 60):
     """Query the status of a job.
+    Transient request errors are retried with exponential backoff.
 
     Args:
         jobid (int): Id of a Transkribus job.
@@ -156,20 +358,70 @@ def get_job_status(jobid: int, sid: str, n_retry: int = 60):
         str: Status of the job.
 
     Raises:
-        Job status cannot be retrieved.
+        TranskribusHTTPError: Job status cannot be retrieved.
     """
-    r = requests.get(f'https://transkribus.eu/TrpServer/rest/jobs/{jobid}'
-                     f'?JSESSIONID={sid}')
-    if r.status_code == requests.codes.ok:
-        return re.search(r'"state":"[A-Z]+"', r.text).group()[9:-1]
-    else:
-        if n_retry > 0:
-            n_retry -= 1
-            time.sleep(60)
-            return get_job_status(jobid, sid, n_retry)
-        else:
-            logging.error(f'Job status cannot be retrieved: {r}, {r.text}')
-            raise
+    return retry(n_retry=n_retry)(_get_job_status)(jobid, sid)
+
+
+def _get_job_status(jobid, sid):
+    # Request the status of a job once
+
+    r = _SESSION.get(BASE_URL + f'jobs/{jobid}',
+                     cookies={'JSESSIONID': sid})
+    _raise_for_status(r, 'Job status cannot be retrieved:')
+    return _find_value(orjson.loads(r.content), 'state')
+
+
+def wait_for_job(jobid, sid, initial=1.0, cap=60.0, factor=2.0):
+    """Wait until a job is completed.
+    The job status is polled immediately and then with increasing intervals,
+    so that short jobs return without delay and long running jobs are not
+    queried needlessly often.
+
+    Args:
+        jobid (int): Id of a Transkribus job.
+        sid (str): Session id to Transkribus server.
+        initial (float): Waiting time in seconds after the first poll.
+        cap (float): Maximal waiting time in seconds between two polls.
+        factor (float): Factor by which the waiting time grows per poll.
+
+    Returns:
+        None.
+
+    Raises:
+        RuntimeError: The job ended with status FAILED or CANCELED.
+    """
+    delay = initial
+    while True:
+        job_status = get_job_status(jobid, sid)
+        if job_status == 'FINISHED':
+            return
+        if job_status in ('FAILED', 'CANCELED'):
+            logging.error(f'Job {jobid} ended with status {job_status}.')
+            raise RuntimeError(f'Job {jobid} ended with status {job_status}.')
+        time.sleep(delay + random.random())
+        delay = min(cap, delay * factor)
+
+
+def wait_for_jobs(jobids, sid, max_workers=8):
+    """Wait until several jobs are completed.
+    The jobs are polled concurrently, each as done by wait_for_job().
+
+    Args:
+        jobids (list): Ids of Transkribus jobs.
+        sid (str): Session id to Transkribus server.
+        max_workers (int): Number of jobs polled concurrently.
+
+    Returns:
+        None.
+
+    Raises:
+        RuntimeError: A job ended with status FAILED or CANCELED.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Consume the results to raise errors of failed jobs.
+        for _ in executor.map(lambda jobid: wait_for_job(jobid, sid), jobids):
+            pass
 
 
 def run_layout_analysis(
@@ -180,11 +432,13 @@ def run_layout_analysis(
         do_line_seg='true',
         do_word_seg='false',
         job_impl='TranskribusLaJob',
-        do_create_job_batch='false'):
+        do_create_job_batch='false',
+        wait=True):
     """Run a layout analysis on Transkribus platform.
     This function start a layout analysis for selected pages within a document
     using the Transkribus API. If the job created is completed, the function
-    returns.
+    returns. If wait is False, the function returns right after the job is
+    created, e.g. to wait for several jobs with wait_for_jobs().
     The structure and content of the xml can be obtained using the Transkribus 
     Expert Client:
     - Start the Transkribus Expert Client via command line.
@@ -192,7 +446,7 @@ def run_layout_analysis(
     - Search the command line for the corresponding POST request.
 
     Args:
-        xml(str): Xml containing the job parameters.
+        xml(str or bytes): Xml containing the job parameters.
         colid (int): Id of collection.
         sid (str): Session id to Transkribus platform.
         do_block_seg (str): Should block segmentation be done?
@@ -200,37 +454,34 @@ def run_layout_analysis(
         do_word_seg (str): Should word segmentation be done?
         job_impl (str): Name of layout analysis method.
         do_create_job_batch (str): Should a job batch be created?
+        wait (bool): Should the function wait until the job is completed?
 
     Returns:
-        None.
+        int: Id of the job.
 
     Raises:
-        Request status code is not OK.
+        TranskribusHTTPError: Request status code is not OK.
+        RuntimeError: Job ended with status FAILED or CANCELED.
     """
 
     # Start the layout analysis.
-    headers = {'Content-Type': 'application/xml', 'Accept': 'application/json'}
-    r = requests.post('https://transkribus.eu/TrpServer/rest/LA',
-                      headers=headers,
-                      data=xml.encode('utf8'),
-                      params={'JSESSIONID': sid,
-                              'collId': colid,
+    r = _SESSION.post(BASE_URL + 'LA',
+                      headers=_LA_HEADERS,
+                      data=_to_bytes(xml),
+                      cookies={'JSESSIONID': sid},
+                      params={'collId': colid,
                               'doBlockSeg': do_block_seg,
                               'doLineSeg': do_line_seg,
                               'doWordSeg': do_word_seg,
                               'jobImpl': job_impl,
                               'doCreateJobBatch': do_create_job_batch})
-    if r.status_code != requests.codes.ok:
-        logging.error(f'Layout analysis execution failed: {r}')
-        raise
+    _raise_for_status(r, 'Layout analysis execution failed:')
 
     # Wait until the job is completed.
-    jobid = int(re.search(r'"jobId":"[0-9]+"', r.text).group()[9:-1])
-    while True:
-        job_status = get_job_status(jobid, sid)
-        if job_status == 'FINISHED':
-            break
-        time.sleep(10)
+    jobid = int(_find_value(orjson.loads(r.content), 'jobId'))
+    if wait:
+        wait_for_job(jobid, sid)
+    return jobid
 
 
 def run_text_recognition(colid, docid, pages,
@@ -246,11 +497,13 @@ def run_text_recognition(colid, docid, pages,
                          clear_lines='true',
                          do_word_seg='true',
                          do_not_delete_work_dir='false',
-                         b2p_backend='Legacy'):
+                         b2p_backend='Legacy',
+                         wait=True):
     """Run a text recognition job on the Transkribus platform.
     This function start a text recognition for selected pages within a document
     using the Transkribus API. If the job created is completed, the function
-    returns.
+    returns. If wait is False, the function returns right after the job is
+    created, e.g. to wait for several jobs with wait_for_jobs().
 
     Args:
         colid (int): Id of collection.
@@ -271,15 +524,16 @@ def run_text_recognition(colid, docid, pages,
         do_not_delete_work_dir (str): Sould the working directory not be
             deleted?
         b2p_backend (str): B2p backend.
+        wait (bool): Should the function wait until the job is completed?
 
     Returns:
-        None.
+        int: Id of the job.
 
     Raises:
-        Request status code is not OK.
+        TranskribusHTTPError: Request status code is not OK.
+        RuntimeError: Job ended with status FAILED or CANCELED.
     """
-    params = {'JSESSIONID': sid,
-              'languageModel': language_model,
+    params = {'languageModel': language_model,
               'id': docid,
               'pages': pages,
               'doLinePolygonSimplification': do_line_polygon_simplification,
@@ -293,22 +547,18 @@ def run_text_recognition(colid, docid, pages,
               'doNotDeleteWorkDir': do_not_delete_work_dir,
               'b2pBackend': b2p_backend
               }
-    r = requests.post(f'https://transkribus.eu/TrpServer/rest/pylaia/{colid}/'
-                      f'{model_id}/recognition',
-                      params=params
+    r = _SESSION.post(BASE_URL + f'pylaia/{colid}/{model_id}/recognition',
+                      params=params,
+                      cookies={'JSESSIONID': sid}
                       )
 
-    if r.status_code != requests.codes.ok:
-        logging.error(f'Text recognition execution failed: {r}, {r.text}')
-        raise
+    _raise_for_status(r, 'Text recognition execution failed:')
 
     # Wait until the job is completed.
     jobid = int(r.text)
-    while True:
-        job_status = get_job_status(jobid, sid)
-        if job_status == 'FINISHED':
-            break
-        time.sleep(10)
+    if wait:
+        wait_for_job(jobid, sid)
+    return jobid
 
 
 def remove_transcript(colid, docid, pagenr, tskey, sid):
@@ -324,20 +574,19 @@ def remove_transcript(colid, docid, pagenr, tskey, sid):
         None.
 
     Raises:
-        Request status code is not OK.
+        TranskribusHTTPError: Request status code is not OK.
     """
-    params = {'JSESSIONID': sid, 'key': tskey}
-    r = requests.post('https://transkribus.eu/TrpServer/rest/collections/'
-                      f'{colid}/{docid}/{pagenr}/delete',
-                      params=params
+    params = {'key': tskey}
+    r = _SESSION.post(BASE_URL + f'collections/{colid}/{docid}/{pagenr}/delete',
+                      params=params,
+                      cookies={'JSESSIONID': sid}
                       )
-    if r.status_code != requests.codes.ok:
-        logging.error(f'Deleting of transcript failed: {r}')
-        raise
+    _raise_for_status(r, 'Deleting of transcript failed:')
 
 
 def download_pagexml(url, path, n_retry=60):
     """Download a pagexml file.
+    Transient request errors are retried with exponential backoff.
 
     Args:
         url (str): Url to a page xml file.
@@ -345,19 +594,27 @@ def download_pagexml(url, path, n_retry=60):
         n_retry (int): Number of retries by request error.
 
     Returns:
-        None.
+        str: Filepath of the page xml file stored.
     """
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-
-        with open(path, "wb") as file:
-            for chunk in response.iter_content(chunk_size=8192):
-                file.write(chunk)
-    except:
-        if n_retry > 0:
-            n_retry -= 1
-            time.sleep(60)
-            download_pagexml(url, path, n_retry)
-        else:
-            response.raise_for_status()
+    return retry(n_retry=n_retry)(_download_pagexml)(url, path)
+
+
+def _download_pagexml(url, path):
+    # Download a pagexml file once
+
+    with _SESSION.get(url, stream=True) as response:
+        _raise_for_status(response, 'url invalid?')
+
+        # Write the decoded response body into the file chunk by chunk. A
+        # partially written file is removed before the request is retried or
+        # the error is raised.
+        try:
+            with open(path, "wb") as file:
+                for chunk in response.iter_content(chunk_size=65536):
+                    file.write(chunk)
+        except Exception:
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+    return path
+
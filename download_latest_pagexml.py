@@ -18,19 +18,26 @@ exported instead of the latest version with any status.
 """
 
 
-import pandas as pd
 from datetime import datetime
+import logging
 import os
+from operator import itemgetter
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 
 
 from connect_transkribus import (get_sid, list_collections, list_documents,
-                                 get_document_content, download_pagexml)
+                                 prefetch_document_contents,
+                                 download_pagexml, close_session)
 
 
 # Define which collections are to be processed.
 COLNAME_PREFIX = 'HGB_1_'
 COLNAME_TRAINING = ['HGB_Training', 'HGB_Experimentell']
 
+# Set the number of pagexmls downloaded concurrently.
+MAX_WORKERS = 16
+
 # Define target directory for pageXMLs.
 DEST_DIR = ('/mnt/research-storage/Projekt_HGB/HGB_pageXML_'
             + datetime.now().strftime('%Y%m%d'))
@@ -42,69 +49,77 @@ def main():
     password = input('Transkribus password:')
     sid = get_sid(user, password)
 
-    # Read all available collections.
-    coll = pd.DataFrame(list_collections(sid))
-
-    # Save pagexmls of all pages within collections of interest.
-    for col in coll.iterrows():
-        if (col[1]['colName'] not in COLNAME_TRAINING
-            and not col[1]['colName'].startswith(COLNAME_PREFIX)):
-            continue
-        docs = list_documents(sid, col[1]['colId'])
-        for doc in docs:
-            if (col[1]['colName'] == 'HGB_Training'
-                and doc['title'].startswith('TRAINING_VALIDATION_SET')):
+    # Save pagexmls of all pages within collections of interest. The
+    # pagexmls are downloaded concurrently while the following pages and
+    # documents are processed.
+    downloads = []
+    try:
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            # Select the collections of interest and request their documents
+            # ahead.
+            coll = [col for col in list_collections(sid)
+                    if (col['colName'] in COLNAME_TRAINING
+                        or col['colName'].startswith(COLNAME_PREFIX))]
+            doc_lists = executor.map(partial(list_documents, sid),
+                                     [col['colId'] for col in coll])
+
+            for col, docs_raw in zip(coll, doc_lists):
+                colid = col['colId']
+                colname = col['colName']
                 # Skip selected documents within collection HGB_Training.
-                continue
-            pages = get_document_content(col[1]['colId'], doc['docId'], sid)
-
-            # Create destination folder.
-            dest_path = f"{DEST_DIR}/{col[1]['colName']}/{doc['title']}"
-            if not os.path.exists(dest_path):
-                os.makedirs(dest_path)
-
-            for page in pages['pageList']['pages']:
-                # Determine the latest transcript.
-                timestamp_latest = datetime.min
-                timestamp_latest_gt = datetime.min
-                index_latest = None
-                index_latest_gt = None
-                index = -1
-                for transcript in page['tsList']['transcripts']:
-                    index += 1
-                    timestamp = datetime.fromtimestamp(
-                        transcript['timestamp']/1000
-                        )
-                    timestamp_latest = max(timestamp_latest, timestamp)
-                    if timestamp_latest == timestamp:
-                        index_latest = index
-
-                    # For HGB_Training, determine the latest transcript basded
-                    # also by the status.
-                    if col[1]['colName'] == 'HGB_Training':
-                        if transcript['status'] == 'GT':
-                            timestamp_latest_gt = max(timestamp_latest_gt,
-                                                      timestamp
-                                                      )
-                            if timestamp_latest_gt == timestamp:
-                                index_latest_gt = index
-
-                if (index_latest_gt is not None
-                    and index_latest != index_latest_gt):
-                    index_latest = index_latest_gt
-
-                # Download pagexml of latest transcript.
-                url_latest = page['tsList']['transcripts'][index_latest]['url']
-                filename_latest = page['tsList']['transcripts'][index_latest][
-                    'fileName']
-                if col[1]['colName'] in COLNAME_TRAINING:
-                    folder = f"{doc['title']}_{str(page['pageNr']).zfill(3)}"
-                    if not os.path.exists(f'{dest_path}/{folder}'):
-                        os.makedirs(f'{dest_path}/{folder}')
-                    path = f'{dest_path}/{folder}/{filename_latest}'
-                else:
-                    path = f'{dest_path}/{filename_latest}'
-                download_pagexml(url_latest, path)
+                docs = [doc for doc in docs_raw
+                        if not (colname == 'HGB_Training'
+                                and doc['title'].startswith(
+                                    'TRAINING_VALIDATION_SET'))]
+
+                # Request the document contents ahead while the pagexmls of
+                # the current document are downloaded.
+                for doc, pages in prefetch_document_contents(colid, docs, sid):
+                    # Create destination folder.
+                    dest_path = f"{DEST_DIR}/{colname}/{doc['title']}"
+                    os.makedirs(dest_path, exist_ok=True)
+
+                    for page in pages['pageList']['pages']:
+                        # Determine the latest transcript. For equal
+                        # timestamps, the last transcript in the list is
+                        # taken.
+                        transcripts = page['tsList']['transcripts'][::-1]
+                        latest = max(transcripts, key=itemgetter('timestamp'))
+
+                        # For HGB_Training, take the latest transcript with
+                        # status GT if available.
+                        if colname == 'HGB_Training':
+                            transcripts_gt = [t for t in transcripts
+                                              if t['status'] == 'GT']
+                            if transcripts_gt:
+                                latest = max(transcripts_gt,
+                                             key=itemgetter('timestamp'))
+
+                        # Download pagexml of latest transcript in the
+                        # background.
+                        url_latest = latest['url']
+                        filename_latest = latest['fileName']
+                        if colname in COLNAME_TRAINING:
+                            folder = (f"{doc['title']}_"
+                                      f"{str(page['pageNr']).zfill(3)}")
+                            os.makedirs(f'{dest_path}/{folder}', exist_ok=True)
+                            path = f'{dest_path}/{folder}/{filename_latest}'
+                        else:
+                            path = f'{dest_path}/{filename_latest}'
+                        downloads.append((path, executor.submit(
+                            download_pagexml, url_latest, path)))
+    finally:
+        # Report all failed downloads and release the connections to
+        # Transkribus.
+        failed = [(path, download.exception()) for path, download in downloads
+                  if download.done() and download.exception()]
+        for path, error in failed:
+            logging.error(f'Download of pagexml {path} failed: {error!r}')
+        close_session()
+
+    # Raise the error of the first failed download.
+    if failed:
+        raise failed[0][1]
 
 
 if __name__ == "__main__":
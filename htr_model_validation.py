@@ -22,12 +22,13 @@ https://huggingface.co/spaces/evaluate-metric/wer
 import re
 import pandas as pd
 import numpy as np
-from evaluate import load
+from rapidfuzz.distance import Levenshtein
 from csv import writer
 import matplotlib.pyplot as plt
 import seaborn as sns
 import xml.etree.ElementTree as et
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 from connect_transkribus import get_page_xml, get_sid, get_document_content
 
@@ -65,9 +66,28 @@ FILTER_STATUS = None
 # The possibilities are the same than for the variable REFERENCE_VERSION.
 PREDICTION_VERSION = 'Model: 52264'
 
+# Set the number of page xmls downloaded concurrently.
+MAX_WORKERS = 16
+
 # Set the bin width of histogram.
 HIST_BINWIDTH = 0.01
 
+# Multiple whitespaces within a textline, reduced to one space before
+# calculating a metric.
+_MULTIPLE_SPACES_RE = re.compile(r'\s\s+')
+
+# Qualified tags of the page xml elements considered.
+PAGE_NS = '{http://schema.primaresearch.org/PAGE/gts/pagecontent/2013-07-15}'
+TEXTREGION_TAG = PAGE_NS + 'TextRegion'
+TEXTLINE_TAG = PAGE_NS + 'TextLine'
+UNICODE_TAG = PAGE_NS + 'Unicode'
+
+# Type of a text region within its custom attribute.
+_TYPE_RE = re.compile(r'type:([a-z]+);')
+
+# Columns of the errors and reference lengths counted per text region.
+COUNT_COLUMNS = ['errors_cer', 'reference_cer', 'errors_wer', 'reference_wer']
+
 
 def get_page_version_index(transcripts, version_keyword):
     """Get the index of a Transkribus page version based on a keyword.
@@ -118,33 +138,25 @@ def get_textregions(url, sid, textregion_types=[]):
         non-empty textregions.
     """
 
-    page_xml = et.fromstring(get_page_xml(url, sid))
+    page_xml = et.fromstring(get_page_xml(url, sid, raw=True))
     textregions = []
-    textline_element = './/{http://schema.primaresearch.org/PAGE'\
-                       '/gts/pagecontent/2013-07-15}TextLine'
-    unicode_element = './/{http://schema.primaresearch.org/'\
-                      'PAGE/gts/pagecontent/2013-07-15}Unicode'
+    textregion_types = frozenset(textregion_types)
 
     # Iterate over the text regions.
-    for textregion in page_xml.iter('{http://schema.primaresearch.org/PAGE'
-                                    '/gts/pagecontent/2013-07-15}TextRegion'):
+    for textregion in page_xml.iter(TEXTREGION_TAG):
         # Get the custom parameter.
         custom = textregion.get('custom')
 
         # Extract the type of text region.
-        match = re.search(r'type:[a-z]+;', custom)
+        match = _TYPE_RE.search(custom or '')
         if match:
-            type = match.group()[5:-1]
+            type = match.group(1)
         else:
             type = None
 
-        # Filter requested textregions.
-        if not textregion_types:
-            # If no filter is provided, all textregions will be processed.
-            pass
-        elif type not in textregion_types:
-            # If filter is given, all not filtered textregion types will be
-            # skipped.
+        # Filter requested textregions. If no filter is provided, all
+        # textregions will be processed.
+        if textregion_types and type not in textregion_types:
             continue
 
         # Get the text region id.
@@ -152,9 +164,9 @@ def get_textregions(url, sid, textregion_types=[]):
 
         # Iterate over the text lines.
         textline_list = []
-        for textline in textregion.findall(textline_element):
+        for textline in textregion.iter(TEXTLINE_TAG):
             # Find all unicode tag childs.
-            unicode = textline.findall(unicode_element)
+            unicode = list(textline.iter(UNICODE_TAG))
 
             # Take only the last entry found. If word chunks are available in
             # the page xml, those unicode chunks will be excluded.
@@ -170,27 +182,41 @@ def get_textregions(url, sid, textregion_types=[]):
     return textregions
 
 
-def calculate_metric(predictions, references, metric, is_valid=True):
-    """Calculating the metric given two lists of the same length.
+def count_errors(predictions, references, metric):
+    """Count the errors of prediction textlines given reference textlines.
+    The Levenshtein distance between each prediction and reference textline
+    is summed, as well as the length of the reference textlines. The
+    textlines are compared by characters for the CER and by words for the
+    WER, as done by the evaluate metrics cer and wer. The metric is the
+    number of errors divided by the length of the references, also over
+    several lists of textlines.
 
     Args:
         predictions (list): List containing prediction textlines.
         references (list): List containing reference textlines.
-        metric (str): Name of metric to be applied.
-        is_valid (boolean): Filter if the textlines are valid.
+        metric (str): Name of metric to be applied ('cer' or 'wer').
 
     Returns:
-        float: Calculated metric value.
+        tuple: Number of errors (int) and length of the references (int).
+
+    Raises:
+        ValueError: If the metric is unknown.
     """
 
-    # Handling not valid features.
-    if not is_valid:
-        return np.nan
+    if metric not in ('cer', 'wer'):
+        raise ValueError(f'Unknown metric {metric}.')
 
-    # Calculating the value.
-    evaluate_metric = load(metric)
-    return evaluate_metric.compute(predictions=predictions,
-                                   references=references)
+    n_errors = 0
+    n_reference = 0
+    for prediction, reference in zip(predictions, references):
+        prediction = _MULTIPLE_SPACES_RE.sub(' ', prediction).strip()
+        reference = _MULTIPLE_SPACES_RE.sub(' ', reference).strip()
+        if metric == 'wer':
+            prediction = prediction.split(' ') if prediction else []
+            reference = reference.split(' ') if reference else []
+        n_errors += Levenshtein.distance(prediction, reference)
+        n_reference += len(reference)
+    return n_errors, n_reference
 
 
 def main():
@@ -215,33 +241,52 @@ def main():
     password = input('Transkribus password:')
     sid = get_sid(user, password)
 
-    # Iterate over every document.
-    textregions = pd.DataFrame(columns=['colid', 'docid', 'pageid', 'pagenr',
-                                        'tsid_reference', 'tsid_prediction',
-                                        'url_reference', 'url_prediction',
-                                        'textregionid', 'type',
-                                        'text_reference', 'text_prediction',
-                                        'is_valid', 'warning_message'])
+    # Iterate over every document. The entries are collected in a list of
+    # rows and converted to a dataframe at the end.
+    rows = []
     for docid in DOCID:
         # Get document metadata.
         doc = get_document_content(COLID, docid, sid)
         logging.info('Processing text regions of document '
                      f"{doc['md']['title']}...")
 
-        # Iterate over every document page.
+        # Determine the reference and prediction version of every page. Pages
+        # with a reference status not in FILTER_STATUS are excluded.
+        versions = []
         for page_nr in range(1, doc['md']['nrOfPages'] + 1):
-            # Get page parameters.
             page = doc['pageList']['pages'][page_nr - 1]
+            transcripts = page['tsList']['transcripts']
+            reference_index = get_page_version_index(transcripts,
+                                                     REFERENCE_VERSION)
+            if (FILTER_STATUS and reference_index is not None
+                    and transcripts[reference_index]['status']
+                    not in FILTER_STATUS):
+                continue
+            prediction_index = get_page_version_index(transcripts,
+                                                      PREDICTION_VERSION)
+            versions.append((page_nr, page, reference_index,
+                             prediction_index))
+
+        # Download the text regions of the reference and prediction versions
+        # of all pages concurrently.
+        urls = {page['tsList']['transcripts'][index]['url']
+                for _, page, reference_index, prediction_index in versions
+                for index in (reference_index, prediction_index)
+                if index is not None}
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            textregions_by_url = dict(zip(urls, executor.map(
+                lambda url: get_textregions(url, sid, TEXTREGION_TYPES),
+                urls)))
 
+        # Iterate over every document page.
+        for page_nr, page, reference_index, prediction_index in versions:
             # Initialize new entry.
             new_entry = {'colid': COLID, 'docid': docid,
                          'pageid': page['pageId'],
                          'pagenr': page_nr, 'is_valid': True}
 
-            # Determine reference version of page.
+            # Check reference version of page.
             transcripts = page['tsList']['transcripts']
-            reference_index = get_page_version_index(transcripts,
-                                                     REFERENCE_VERSION)
             if reference_index is None:
                 logging.warning('No reference transcript version found'
                                 f'using the keyword {REFERENCE_VERSION}. '
@@ -250,21 +295,13 @@ def main():
                 new_entry['warning_message'] = 'No reference transcript '\
                     'version found.'
                 new_entry['is_valid'] = False
-                textregions = pd.concat([textregions,
-                                         pd.Series(new_entry).to_frame().T
-                                         ], ignore_index=True)
+                rows.append(new_entry.copy())
                 continue
             reference_transcript = transcripts[reference_index]
-            if FILTER_STATUS:
-                # Exclude page, when status is not in FILTER_STATUS.
-                if reference_transcript['status'] not in FILTER_STATUS:
-                    continue
             new_entry['tsid_reference'] = reference_transcript['tsId']
             new_entry['url_reference'] = reference_transcript['url']
 
-            # Determine prediction version of page.
-            prediction_index = get_page_version_index(transcripts,
-                                                      PREDICTION_VERSION)
+            # Check prediction version of page.
             if prediction_index is None:
                 logging.warning('No prediction transcript version found. '
                                 f'using the keyword {PREDICTION_VERSION}. '
@@ -273,9 +310,7 @@ def main():
                 new_entry['warning_message'] = 'No prediction transcript '\
                     'version found.'
                 new_entry['is_valid'] = False
-                textregions = pd.concat([textregions,
-                                         pd.Series(new_entry).to_frame().T
-                                         ], ignore_index=True)
+                rows.append(new_entry.copy())
                 continue
             prediction_transcript = transcripts[prediction_index]
             new_entry['tsid_prediction'] = prediction_transcript['tsId']
@@ -293,14 +328,12 @@ def main():
                 new_entry['warning_message'] = 'Reference and prediction '\
                     'transcript are the same.'
                 new_entry['is_valid'] = False
-                textregions = pd.concat([textregions,
-                                         pd.Series(new_entry).to_frame().T
-                                         ], ignore_index=True)
+                rows.append(new_entry.copy())
                 continue
 
             # Get text regions of reference version of transcript.
-            reference_textregions = get_textregions(
-                reference_transcript['url'], sid, TEXTREGION_TYPES)
+            reference_textregions = textregions_by_url[
+                reference_transcript['url']]
             if not reference_textregions:
                 logging.warning('No non-empty textregions found for reference '
                                 'transcript. tsId = '
@@ -311,14 +344,12 @@ def main():
                     '(of selected types) found for '\
                     'reference transcript.'
                 new_entry['is_valid'] = False
-                textregions = pd.concat([textregions,
-                                         pd.Series(new_entry).to_frame().T
-                                         ], ignore_index=True)
+                rows.append(new_entry.copy())
                 continue
 
             # Get text regions of prediction version of transcript.
-            prediction_textregions = get_textregions(
-                prediction_transcript['url'], sid, TEXTREGION_TYPES)
+            prediction_textregions = textregions_by_url[
+                prediction_transcript['url']]
             if not prediction_textregions:
                 logging.warning('No non-empty textregions found for prediction'
                                 ' transcript. tsId = '
@@ -329,11 +360,14 @@ def main():
                     '(of selected types) found for '\
                     'prediction transcript.'
                 new_entry['is_valid'] = False
-                textregions = pd.concat([textregions,
-                                         pd.Series(new_entry).to_frame().T
-                                         ], ignore_index=True)
+                rows.append(new_entry.copy())
                 continue
 
+            # Map the ids of the prediction text regions to their textlines.
+            # For duplicate ids, the first text region is kept.
+            prediction_texts = {tr[0]: tr[-1]
+                                for tr in reversed(prediction_textregions)}
+
             # Iterate over text regions of reference transcript.
             for reference_tr in reference_textregions:
                 tr_id = reference_tr[0]
@@ -344,10 +378,8 @@ def main():
                 new_entry['is_valid'] = True
 
                 # Check if text region is in prediction transcript available.
-                prediction_ids = [row[0] for row in prediction_textregions]
-                if tr_id in prediction_ids:
-                    new_entry['text_prediction'] = prediction_textregions[
-                        prediction_ids.index(tr_id)][-1]
+                if tr_id in prediction_texts:
+                    new_entry['text_prediction'] = prediction_texts[tr_id]
                 else:
                     logging.warning('No prediction transcript textregion found'
                                     f' for textregion id {tr_id}: tsId = '
@@ -358,9 +390,7 @@ def main():
                         'found for this textregion.'
                     new_entry['is_valid'] = False
                     new_entry['text_prediction'] = np.nan
-                    textregions = pd.concat([textregions,
-                                             pd.Series(new_entry).to_frame().T
-                                             ], ignore_index=True)
+                    rows.append(new_entry.copy())
                     continue
 
                 # Handling reference and perdiction of different length.
@@ -376,84 +406,68 @@ def main():
                     new_entry['warning_message'] = 'Prediction and reference '\
                         'transcript do not have same length.'
                     new_entry['is_valid'] = False
-                    textregions = pd.concat([textregions,
-                                             pd.Series(new_entry).to_frame().T
-                                             ], ignore_index=True)
+                    rows.append(new_entry.copy())
                     continue
 
                 # Add new entry
-                textregions = pd.concat([textregions,
-                                         pd.Series(new_entry).to_frame().T
-                                         ], ignore_index=True)
+                rows.append(new_entry.copy())
 
+    textregions = pd.DataFrame(rows,
+                               columns=['colid', 'docid', 'pageid', 'pagenr',
+                                        'tsid_reference', 'tsid_prediction',
+                                        'url_reference', 'url_prediction',
+                                        'textregionid', 'type',
+                                        'text_reference', 'text_prediction',
+                                        'is_valid', 'warning_message'],
+                               dtype=object)
     logging.info(f'{len(textregions)} text regions of interest read.')
 
     if textregions.empty:
         logging.error('No textregion processed. No metric can be calculated.')
-        raise
+        raise RuntimeError('No textregion processed. No metric can be '
+                           'calculated.')
 
     ##
     # Calculate character error rate (CER) and word error rate (WER).
     ##
 
+    # Count the errors and the length of the references per valid text
+    # region. The CER and WER over several text regions are derived from the
+    # sums of these counts.
+    valid = textregions[textregions['is_valid'].astype(bool)]
+    counts = pd.DataFrame(
+        [count_errors(prediction, reference, 'cer')
+         + count_errors(prediction, reference, 'wer')
+         for prediction, reference in zip(valid['text_prediction'],
+                                          valid['text_reference'])],
+        columns=COUNT_COLUMNS, index=valid.index)
+    counts['pageid'] = valid['pageid']
+    counts['type'] = valid['type']
+
     # Calculate the global CER and WER over all text regions in consideration.
-    texts_reference = []
-    texts_prediction = []
-    for row in textregions.iterrows():
-        if row[1]['is_valid']:
-            texts_reference.extend(row[1]['text_reference'])
-            texts_prediction.extend(row[1]['text_prediction'])
-    global_cer = round(calculate_metric(predictions=texts_prediction,
-                                        references=texts_reference,
-                                        metric='cer'), 3)
-    global_wer = round(calculate_metric(predictions=texts_prediction,
-                                        references=texts_reference,
-                                        metric='wer'), 3)
+    total = counts[COUNT_COLUMNS].sum().to_dict()
+    global_cer = round(total['errors_cer'] / total['reference_cer'], 3)
+    global_wer = round(total['errors_wer'] / total['reference_wer'], 3)
     logging.info(f"Global CER: {global_cer}")
     logging.info(f"Global WER: {global_wer}")
 
     # Calculate the CER and WER per type of text regions.
-    textregions_groups = textregions.groupby('type')
-    for group_name, df_group in textregions_groups:
-        texts_reference = []
-        texts_prediction = []
-        for row in df_group.iterrows():
-            if row[1]['is_valid']:
-                texts_reference.extend(row[1]['text_reference'])
-                texts_prediction.extend(row[1]['text_prediction'])
-        tr_type_cer = round(calculate_metric(predictions=texts_prediction,
-                                             references=texts_reference,
-                                             metric='cer'), 3)
-        tr_type_wer = round(calculate_metric(predictions=texts_prediction,
-                                             references=texts_reference,
-                                             metric='wer'), 3)
+    type_counts = counts.groupby('type')[COUNT_COLUMNS].sum()
+    for group_name, n in type_counts.to_dict('index').items():
+        tr_type_cer = round(n['errors_cer'] / n['reference_cer'], 3)
+        tr_type_wer = round(n['errors_wer'] / n['reference_wer'], 3)
         logging.info(f"CER for textregion type {group_name}: {tr_type_cer}")
         logging.info(f"WER for textregion type {group_name}: {tr_type_wer}")
 
-    # Calculate the CER and WER for each Transkribus page.
-    textregions_groups = textregions.groupby('pageid')
+    # Calculate the CER and WER for each Transkribus page. Pages without
+    # valid text regions or with empty reference textlines only are excluded.
+    page_counts = counts.groupby('pageid')[COUNT_COLUMNS].sum()
+    page_counts = page_counts[page_counts['reference_cer'] > 0]
     cer_pages = {}
     wer_pages = {}
-    for group_name, df_group in textregions_groups:
-        texts_reference = []
-        texts_prediction = []
-        for row in df_group.iterrows():
-            if row[1]['is_valid']:
-                texts_reference.extend(row[1]['text_reference'])
-                texts_prediction.extend(row[1]['text_prediction'])
-
-        # Exclude empty pages.
-        if texts_prediction == [] or texts_prediction == []:
-            continue
-
-        cer_pages[group_name] = round(calculate_metric(
-            predictions=texts_prediction,
-            references=texts_reference,
-            metric='cer'), 3)
-        wer_pages[group_name] = round(calculate_metric(
-            predictions=texts_prediction,
-            references=texts_reference,
-            metric='wer'), 3)
+    for group_name, n in page_counts.to_dict('index').items():
+        cer_pages[group_name] = round(n['errors_cer'] / n['reference_cer'], 3)
+        wer_pages[group_name] = round(n['errors_wer'] / n['reference_wer'], 3)
     logging.info('CER and WER calcuated per Transkribus page.')
 
     # Plot histograms for scores per Transkribus page with kernel density
@@ -472,18 +486,8 @@ def main():
     logging.info(f'Histogram for WER per page created: {wer_hist_dir}.')
 
     # Calculate CER and WER for each text region.
-    textregions['cer'] = textregions.apply(
-        lambda row: calculate_metric(predictions=row['text_prediction'],
-                                     references=row['text_reference'],
-                                     metric='cer',
-                                     is_valid=row['is_valid']
-                                     ), axis=1)
-    textregions['wer'] = textregions.apply(
-        lambda row: calculate_metric(predictions=row['text_prediction'],
-                                     references=row['text_reference'],
-                                     metric='wer',
-                                     is_valid=row['is_valid']
-                                     ), axis=1)
+    textregions['cer'] = counts['errors_cer'] / counts['reference_cer']
+    textregions['wer'] = counts['errors_wer'] / counts['reference_wer']
     logging.info('CER and WER calcuated per text region.')
 
     ##
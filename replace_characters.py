@@ -9,29 +9,31 @@ and replace them by other characters. A selected collection was considered.
 
 
 import re
+from collections import Counter
 from connect_transkribus import *
 
 
-def contains_character(char, search_string):
-    # Test if a character occurs in string given
+# Text content of the Unicode elements within a page xml
+UNICODE_RE = re.compile(r'<Unicode>([^<]*)</Unicode>')
 
-    match = re.search(char, search_string)
-    if match:
-        return True
-    else:
-        return False
 
+def unicode_text(page_xml):
+    # Concatenate the text content of all Unicode elements of a page xml
 
-def replace_string(page_xml, str_search, str_replace):
-    # Replaces strings within Unicode areas of a page xml
+    return ''.join(UNICODE_RE.findall(page_xml))
 
-    str_match = re.findall(r'<Unicode>.*%s.*</Unicode>' % str_search, page_xml)
-    n_replaced = 0
-    for match in str_match:
-        match_replaced = re.sub(str_search, str_replace, match)
-        page_xml, n = re.subn(match, match_replaced, page_xml)
-        n_replaced += n
-    return page_xml, n_replaced
+
+def replace_characters(page_xml, char_table):
+    # Replace characters within the Unicode elements of a page xml only
+
+    return UNICODE_RE.sub(lambda m: f'<Unicode>{m.group(1).translate(char_table)}</Unicode>', page_xml)
+
+
+def count_characters(chars, search_string):
+    # Count the occurrences of selected characters in string given
+
+    counts = Counter(search_string)
+    return {char: counts[char] for char in chars if counts[char]}
 
 
 if __name__ == "__main__":   
@@ -55,44 +57,43 @@ if __name__ == "__main__":
 
     # Define which characters should be replaced
     char_replace = {'ȶ': 't', 'ƒ': 'f', 'Ħ': 'H', 'Ŋ': 'No', 'ȴ': 'l'}
+    char_table = str.maketrans(char_replace)
 
     docs = list_documents(sid, colid)
 
     # Iterate over all documents of hgb_training
     for row in docs:
         # Excluding documents beginning with title TRAINING_VALIDATION_SET_HGB
-        if re.match(r'^TRAINING_VALIDATION_SET_HGB', row['title']):
+        if row['title'].startswith('TRAINING_VALIDATION_SET_HGB'):
             logging.info(f"No changes will be done on document {row['title']}.")
             continue
 
         logging.info(f"Query pages of document {row['title']} ...")
 
-        doc_content = get_document_content(colid, row['docId'], sid)
+        page_urls = index_page_urls(get_document_content(colid, row['docId'], sid))
 
         # Iterate over every document page
+        changed_pages = []
         for page_nr in range(1, row['nrOfPages'] + 1):
-            has_changed = False
-            
-            xml_url = get_page_xml_url(doc_content, page_nr, page_version)
+            xml_url = page_urls[(page_nr, page_version)]
             page_xml = get_page_xml(xml_url, sid)
 
-            # Iterate over special characters
-            for char in char_replace:
-
-                # Check if page xml contains the character
-                if contains_character(char, page_xml):
-                    # Replace the character
-                    page_xml, n_replaced = replace_string(page_xml, char, char_replace[char])
-                    logging.info(f"Character {char} is {n_replaced} times included on page number {page_nr} of document {row['title']}. Page xml: {xml_url}")
-                    has_changed = True
-            
-            if has_changed:
-                # Upload edited page xml to Transkribus
-                post_success = post_page_xml(page_xml, colid, row['docId'], page_nr, sid, comment='Special characters replaced.')
-                if post_success:
-                    logging.info(f"The edited page xml of page number {page_nr} of document {row['title']} was uploaded to Transkribus.")
-                else:
-                    logging.error(f"The edited page xml of page number {page_nr} of document {row['title']} can't be uploaded to Transkribus.")
-                    raise
+            # Count the special characters within the Unicode elements
+            char_counts = count_characters(char_replace, unicode_text(page_xml))
+            for char, n_char in char_counts.items():
+                logging.info(f"Character {char} is {n_char} times included on page number {page_nr} of document {row['title']}. Page xml: {xml_url}")
+
+            # Replace all special characters in one pass
+            if char_counts:
+                changed_pages.append((page_nr, replace_characters(page_xml, char_table)))
+
+        # Upload edited page xmls of the document to Transkribus
+        post_successes = post_page_xmls(changed_pages, colid, row['docId'], sid, comment='Special characters replaced.')
+        for (page_nr, _), post_success in zip(changed_pages, post_successes):
+            if post_success:
+                logging.info(f"The edited page xml of page number {page_nr} of document {row['title']} was uploaded to Transkribus.")
+            else:
+                logging.error(f"The edited page xml of page number {page_nr} of document {row['title']} can't be uploaded to Transkribus.")
+                raise RuntimeError(f"The edited page xml of page number {page_nr} of document {row['title']} can't be uploaded to Transkribus.")
 
     logging.info('Script finished.')
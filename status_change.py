@@ -10,8 +10,10 @@ the following parameters per Transkribus page available in a csv file:
 
 import logging
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from connect_transkribus import (get_sid, get_colid, list_documents,
-                                 get_document_content, update_page_status)
+                                 prefetch_document_contents,
+                                 update_page_status, invalidate_caches)
 
 
 # Set directory of csv file containing the Trankribus pages to be changed.
@@ -28,6 +30,9 @@ STATUS = 'DONE'
 COMMENT = ('Page identified as part of the "Reichspfennigverzeichnis". '
            'Status set to DONE.')
 
+# Set the number of status updates sent to Transkribus concurrently.
+MAX_WORKERS = 16
+
 
 def main():
     # Define logging environment.
@@ -49,58 +54,84 @@ def main():
 
     # Determine the necessary variables for updating the status.
     # Get collection id.
-    lut_coll = pd.DataFrame()
-    lut_coll['colname'] = pd.unique(edit_pages['colname'])
-    lut_coll['colid'] = lut_coll.apply(
-        lambda row: get_colid(col_name=row['colname'], sid=sid), axis=1)
-    edit_pages['colid'] = edit_pages.apply(
-        lambda row: lut_coll[
-            lut_coll['colname'] == row['colname']
-            ]['colid'].iloc[0], axis=1)
+    colnames = pd.unique(edit_pages['colname'])
+    lut_coll = pd.DataFrame({
+        'colname': colnames,
+        'colid': [get_colid(col_name=colname, sid=sid)
+                  for colname in colnames]})
+    edit_pages['colid'] = edit_pages['colname'].map(
+        dict(zip(lut_coll['colname'], lut_coll['colid'])))
 
     # Create a lookup table for affected documents to get their document ids.
-    lut_doc = pd.DataFrame(columns=['docid', 'tsid'])
-    lut_doc['docname'] = pd.unique(edit_pages['title'])
-    lut_doc['colname'] = lut_doc.apply(
-        lambda row: edit_pages[edit_pages['title'] == row['docname']]
-        ['colname'].iloc[0], axis=1)
+    # A document title may occur in several collections, the documents are
+    # therefore identified by title and collection.
+    lut_doc = edit_pages.drop_duplicates(['title', 'colname'])[
+        ['title', 'colname']].rename(columns={'title': 'docname'}).reset_index(
+        drop=True)
+
+    # Group the documents by collection and the pages by document once.
+    lut_doc_by_col = lut_doc.groupby('colname')
+    pages_by_doc = edit_pages.groupby(['title', 'colname'])
+
+    # Collect the document and transcript ids per row index.
+    docids = {}
+    tsids = {}
+
+    # Request the document lists of all affected collections concurrently.
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        doc_lists = list(executor.map(
+            lambda colid: list_documents(sid=sid, colid=colid),
+            lut_coll['colid']))
 
     # Iterate over affected collections.
-    for row in lut_coll.iterrows():
-        docs = pd.DataFrame(list_documents(sid=sid, colid=row[1]['colid']))
-        lut_docs = lut_doc[lut_doc['colname'] == row[1]['colname']]
-
-        # Iterate over affected documents.
-        for i, r in lut_docs.iterrows():
-            docname = r['docname']
-            docid = docs[docs['title'] == docname]['docId'].iloc[0]
-
-            # Save the document id in lookup table.
-            lut_doc.at[i, 'docid'] = docid
-
-            # Receive the document content for getting the transkript id.
-            doc_content = get_document_content(colid=row[1]['colid'],
-                                               docid=docid, sid=sid)
-            pages = edit_pages[edit_pages['title'] == docname]
+    for colname, colid, doc_list in zip(lut_coll['colname'],
+                                        lut_coll['colid'], doc_lists):
+        docs_by_title = pd.DataFrame(doc_list).drop_duplicates(
+            'title').set_index('title')['docId']
+
+        # Save the document ids of affected documents for the lookup table.
+        docs = []
+        for i, docname in lut_doc_by_col.get_group(colname)[
+                'docname'].items():
+            docids[i] = docs_by_title.loc[docname]
+            docs.append({'docId': docids[i], 'title': docname})
+
+        # Iterate over affected documents. The document contents for getting
+        # the transkript ids are requested ahead.
+        for doc, doc_content in prefetch_document_contents(colid, docs, sid):
+            pages = pages_by_doc.get_group((doc['title'], colname))
 
             # Iterate over affected pages.
-            for j, t in pages.iterrows():
+            doc_pages = doc_content['pageList']['pages']
+            for j, title, pagenr in pages[['title', 'pagenr']].itertuples(
+                    name=None):
+                if not 0 < pagenr <= len(doc_pages):
+                    logging.warning(
+                        f"Page not found. Document title: {title}, "
+                        f"page number: {pagenr}.")
+                    continue
+                transcripts = doc_pages[pagenr - 1]['tsList']['transcripts']
+                if not transcripts:
+                    logging.warning(
+                        f"No transcript found. Document title: {title}, "
+                        f"page number: {pagenr}.")
+                    continue
+
                 # Store the transcript id of the latest version (first entry
                 # in list).
-                try:
-                    edit_pages.at[j, 'tsid'] = (
-                        doc_content['pageList']['pages'][t['pagenr'] - 1]
-                        ['tsList']['transcripts'][0]['tsId'])
-                except Exception as e:
-                    logging.warning(
-                        f"Page not found. Document title: {t['title']}, "
-                        f"page number: {t['pagenr']}. Error message: "
-                        f'{str(e)}')
+                tsids[j] = transcripts[0]['tsId']
+
+    # Store the ids collected. The transcript ids are nullable integers,
+    # since pages not found have no transcript id.
+    lut_doc['docid'] = pd.Series(docids, index=lut_doc.index)
+    edit_pages['tsid'] = pd.Series(tsids, index=edit_pages.index,
+                                   dtype='Int64')
 
     # Get document id.
-    edit_pages['docid'] = edit_pages.apply(
-        lambda row: lut_doc[lut_doc['docname'] == row['title']]
-        ['docid'].iloc[0], axis=1)
+    docid_by_doc = dict(zip(zip(lut_doc['docname'], lut_doc['colname']),
+                            lut_doc['docid']))
+    edit_pages['docid'] = [docid_by_doc.get(doc) for doc in zip(
+        edit_pages['title'], edit_pages['colname'])]
 
     # Export the dataframe.
     edit_pages.to_csv(DATA_OUTPUT_DIR, index=False, header=True)
@@ -108,22 +139,42 @@ def main():
                  f'{DATA_OUTPUT_DIR}.')
 
     # Adapt status of selected Transkribus pages.
-    for row in edit_pages.iterrows():
-        logging.info(
-            f"Updating status of document {row[1]['title']}, page number "
-            f"{row[1]['pagenr']}...")
-        try:
-            update_page_status(colid=row[1]['colid'],
-                               docid=row[1]['docid'],
-                               pagenr=row[1]['pagenr'],
-                               transcriptid=int(row[1]['tsid']),
-                               status=STATUS,
-                               sid=sid,
-                               comment=COMMENT)
-        except Exception as e:
-            logging.warning(
-                f"Status not updated. Document title: {row[1]['title']}, "
-                f"page number: {row[1]['pagenr']}, error message: {str(e)}")
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {}
+        for title, pagenr, colid, docid, tsid in edit_pages[
+                ['title', 'pagenr', 'colid', 'docid', 'tsid']
+                ].itertuples(index=False, name=None):
+            logging.info(
+                f'Updating status of document {title}, page number '
+                f'{pagenr}...')
+            if pd.isna(tsid):
+                logging.warning(
+                    f'Status not updated. Document title: {title}, '
+                    f'page number: {pagenr}, error message: no transcript '
+                    'id available.')
+                continue
+            future = executor.submit(update_page_status,
+                                     colid=colid,
+                                     docid=docid,
+                                     pagenr=pagenr,
+                                     transcriptid=tsid,
+                                     status=STATUS,
+                                     sid=sid,
+                                     comment=COMMENT)
+            futures[future] = (title, pagenr)
+
+        for future in as_completed(futures):
+            title, pagenr = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                logging.warning(
+                    f'Status not updated. Document title: {title}, '
+                    f'page number: {pagenr}, error message: {str(e)}')
+
+    # The page statuses changed on Transkribus. Drop the cached collection
+    # and document lists.
+    invalidate_caches()
 
     logging.info('Script finished.')
 